@@ -1,5 +1,5 @@
 import os, json, sqlite3, redis, time
-from cachetools import TTLCache
+from cachetools import TLRUCache
 #from abc import ABC, abstractmethod
 
 
@@ -8,6 +8,10 @@ from cachetools import TTLCache
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CACHE_FILE = os.path.join(BASE_DIR, "cache.json")
 SQLITE_DB = os.path.join(BASE_DIR, "cache.sqlite")
+SQLITE_COLUMNS = "user_id, ip, port, nat_type, timestamp, ipv6_ip, ipv6_port, expires_at, ipv4_timestamp, ipv6_timestamp"
+SNAPSHOT_FORMAT = "conexia-snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_BATCH_SIZE = 1000  # Entries written per transaction/pipeline when restoring
 
 
 '''
@@ -30,25 +34,62 @@ class BaseCache(ABC):
         pass
 '''
 
+def _batched(iterable, size=SNAPSHOT_BATCH_SIZE):
+    """Yield lists of up to `size` items so restores stay bounded in memory."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 # ================================
-# 1️⃣ In-Memory Cache (TTLCache)
+# 1️⃣ In-Memory Cache (TLRUCache)
 # ================================
 class InMemoryCache:
     def __init__(self, max_size=100, ttl=300):
-        """Initialize TTL cache with a max size and expiration time (TTL)."""
-        self.cache = TTLCache(maxsize=max_size, ttl=ttl)
+        """Initialize TTL cache with a max size and expiration time (TTL).
+
+        Values are stored as `(expires_at, entry)` so restored snapshot
+        entries can keep their remaining TTL.
+        """
+        self.ttl = ttl
+        self.cache = TLRUCache(maxsize=max_size, ttu=lambda _key, value, _now: value[0], timer=time.monotonic)
 
     def get_cached_info(self, user_id):
         """Retrieve STUN info if available in cache."""
-        return self.cache.get(user_id)
+        item = self.cache.get(user_id)
+        return item[1] if item else None
 
-    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp):
+    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp, ipv6_ip=None, ipv6_port=None,
+                        ipv4_timestamp=None, ipv6_timestamp=None):
         """Store STUN info in cache."""
-        self.cache[user_id] = {
+        self.cache[user_id] = (time.monotonic() + self.ttl, {
             "user_id": user_id,
-            "data": {"ip": ip, "port": port, "nat_type": nat_type},
+            "data": {
+                "ip": ip, "port": port, "nat_type": nat_type, "ipv6_ip": ipv6_ip, "ipv6_port": ipv6_port,
+                "ipv4_timestamp": ipv4_timestamp, "ipv6_timestamp": ipv6_timestamp,
+            },
             "timestamp": timestamp,
-        }
+        })
+
+    def iter_snapshot(self):
+        """Yield `(entry, remaining_ttl)` for every live entry."""
+        for user_id in list(self.cache.keys()):
+            item = self.cache.get(user_id)
+            if item:
+                yield item[1], item[0] - time.monotonic()
+
+    def restore_snapshot(self, records):
+        """Store `(entry, remaining_ttl)` records, keeping their remaining TTL."""
+        count = 0
+        for entry, remaining in records:
+            self.cache[entry["user_id"]] = (time.monotonic() + remaining, entry)
+            count += 1
+        return count
 
     def clear_cache(self, user_id=None):
         """Clear cache for a specific user_id or all if None."""
@@ -67,11 +108,15 @@ class FileCache:
         self.ttl = ttl
         self.cache = self._load_cache()  # ✅ Load cache properly
 
-    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp):
+    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp, ipv6_ip=None, ipv6_port=None,
+                        ipv4_timestamp=None, ipv6_timestamp=None):
         """Store STUN info in a file with timestamps."""
         self.cache[user_id] = {
             "user_id": user_id,
-            "data": {"ip": ip, "port": port, "nat_type": nat_type},
+            "data": {
+                "ip": ip, "port": port, "nat_type": nat_type, "ipv6_ip": ipv6_ip, "ipv6_port": ipv6_port,
+                "ipv4_timestamp": ipv4_timestamp, "ipv6_timestamp": ipv6_timestamp,
+            },
             "timestamp": timestamp,
         }
         self._save_cache()
@@ -81,10 +126,34 @@ class FileCache:
         entry = self.cache.get(user_id, None)  # ✅ Now `self.cache` is a dictionary
         if not entry or "timestamp" not in entry:
             return None
-        if time.time() - entry["timestamp"] < self.ttl:
-            return entry
+        if self._expires_at(entry) > time.time():
+            return {key: value for key, value in entry.items() if key != "expires_at"}
         return None
 
+    def _expires_at(self, entry):
+        """Restored entries carry their own expiry; others expire `ttl` after their timestamp."""
+        return entry.get("expires_at") or entry["timestamp"] + self.ttl
+
+    def iter_snapshot(self):
+        """Yield `(entry, remaining_ttl)` for every live entry."""
+        now = time.time()
+        for entry in list(self.cache.values()):
+            if "timestamp" in entry and self._expires_at(entry) > now:
+                yield {key: value for key, value in entry.items() if key != "expires_at"}, self._expires_at(entry) - now
+
+    def restore_snapshot(self, records):
+        """Store `(entry, remaining_ttl)` records and save the file once.
+
+        The whole file is held in memory and rewritten, so restores into this
+        backend are not bounded; warm large caches with sqlite or redis instead.
+        """
+        count = 0
+        for entry, remaining in records:
+            self.cache[entry["user_id"]] = dict(entry, expires_at=time.time() + remaining)
+            count += 1
+        self._save_cache()
+        return count
+
     def _load_cache(self):
         """Load cache from file, return empty dict if file does not exist."""
         if os.path.exists(self.file_path):
@@ -128,35 +197,96 @@ class SQLiteCache:
                         ip TEXT,
                         port INTEGER,
                         nat_type TEXT,
-                        timestamp REAL
+                        timestamp REAL,
+                        ipv6_ip TEXT,
+                        ipv6_port INTEGER,
+                        expires_at REAL,
+                        ipv4_timestamp REAL,
+                        ipv6_timestamp REAL
                     )
                 """
             )
-
-    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp):
+            # Tables created by older versions lack the dual-stack and snapshot columns
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(stun_cache)")]
+            for column, column_type in (
+                ("ipv6_ip", "TEXT"), ("ipv6_port", "INTEGER"), ("expires_at", "REAL"),
+                ("ipv4_timestamp", "REAL"), ("ipv6_timestamp", "REAL"),
+            ):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE stun_cache ADD COLUMN {column} {column_type}")
+
+    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp, ipv6_ip=None, ipv6_port=None,
+                        ipv4_timestamp=None, ipv6_timestamp=None):
         """Insert STUN info with timestamp."""
         with sqlite3.connect(self.db_path) as conn:
             conn.execute(
-                "REPLACE INTO stun_cache (user_id, ip, port, nat_type, timestamp) VALUES (?, ?, ?, ?, ?)",
-                (user_id, ip, port, nat_type, timestamp),
+                "REPLACE INTO stun_cache (user_id, ip, port, nat_type, timestamp, ipv6_ip, ipv6_port, "
+                "ipv4_timestamp, ipv6_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, ip, port, nat_type, timestamp, ipv6_ip, ipv6_port, ipv4_timestamp, ipv6_timestamp),
             )
 
     def get_cached_info(self, user_id):
         """Retrieve STUN info if not expired, otherwise delete it."""
         with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT * FROM stun_cache WHERE user_id=?", (user_id,))
+            cursor = conn.execute(
+                f"SELECT {SQLITE_COLUMNS} FROM stun_cache WHERE user_id=?",
+                (user_id,),
+            )
             row = cursor.fetchone()
             if row:
                 current_time = time.time()
-                if current_time - row[4] < self.ttl:
-                    return {
-                        "user_id": row[0],
-                        "data": {"ip": row[1], "port": row[2], "nat_type": row[3]},
-                        "timestamp": row[4],
-                    }
+                if self._expires_at(row) > current_time:
+                    return self._row_to_entry(row)
                 conn.execute("DELETE FROM stun_cache WHERE user_id=?", (user_id,))   # Cleanup expired entry
         return None
 
+    def _expires_at(self, row):
+        """Restored rows carry their own expiry; others expire `ttl` after their timestamp."""
+        return row[7] or row[4] + self.ttl
+
+    @staticmethod
+    def _row_to_entry(row):
+        return {
+            "user_id": row[0],
+            "data": {
+                "ip": row[1], "port": row[2], "nat_type": row[3], "ipv6_ip": row[5], "ipv6_port": row[6],
+                "ipv4_timestamp": row[8], "ipv6_timestamp": row[9],
+            },
+            "timestamp": row[4],
+        }
+
+    def iter_snapshot(self):
+        """Yield `(entry, remaining_ttl)` for every live row, reading rows lazily."""
+        now = time.time()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.execute(
+                f"SELECT {SQLITE_COLUMNS} FROM stun_cache"
+            )
+            for row in cursor:
+                if self._expires_at(row) > now:
+                    yield self._row_to_entry(row), self._expires_at(row) - now
+
+    def restore_snapshot(self, records):
+        """Insert `(entry, remaining_ttl)` records in batched transactions."""
+        count = 0
+        for batch in _batched(records):
+            now = time.time()
+            with sqlite3.connect(self.db_path) as conn:
+                conn.executemany(
+                    f"REPLACE INTO stun_cache ({SQLITE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            entry["user_id"], entry["data"].get("ip"), entry["data"].get("port"),
+                            entry["data"].get("nat_type"), entry["timestamp"], entry["data"].get("ipv6_ip"),
+                            entry["data"].get("ipv6_port"), now + remaining, entry["data"].get("ipv4_timestamp"),
+                            entry["data"].get("ipv6_timestamp"),
+                        )
+                        for entry, remaining in batch
+                    ],
+                )
+            count += len(batch)
+        return count
+
     def clear_cache(self, user_id=None):
         """Clear cache for a specific user_id or all if None."""
         with sqlite3.connect(self.db_path) as conn:
@@ -175,11 +305,15 @@ class RedisCache:
         self.redis = redis.from_url(redis_url)
         self.ttl = ttl
 
-    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp):
+    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp, ipv6_ip=None, ipv6_port=None,
+                        ipv4_timestamp=None, ipv6_timestamp=None):
         """Cache STUN info with automatic expiry."""
         data = json.dumps({
             "user_id": user_id,
-            "data": {"ip": ip, "port": port, "nat_type": nat_type},
+            "data": {
+                "ip": ip, "port": port, "nat_type": nat_type, "ipv6_ip": ipv6_ip, "ipv6_port": ipv6_port,
+                "ipv4_timestamp": ipv4_timestamp, "ipv6_timestamp": ipv6_timestamp,
+            },
             "timestamp": timestamp,
         })
         self.redis.setex(user_id, self.ttl, data)  # Automatically expires after `ttl` seconds
@@ -192,6 +326,36 @@ class RedisCache:
         except json.JSONDecodeError:
             return None
 
+    def iter_snapshot(self):
+        """Yield `(entry, remaining_ttl)` for every STUN entry, scanning keys in batches."""
+        for keys in _batched(self.redis.scan_iter(count=SNAPSHOT_BATCH_SIZE)):
+            pipe = self.redis.pipeline()
+            for key in keys:
+                pipe.get(key)
+                pipe.pttl(key)
+            # Other data types in the same database answer GET with WRONGTYPE; skip them
+            results = pipe.execute(raise_on_error=False)
+            for data, remaining_ms in zip(results[::2], results[1::2]):
+                if isinstance(data, redis.exceptions.ResponseError):
+                    continue
+                try:
+                    entry = json.loads(data) if data else None
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue  # Not a STUN entry
+                if isinstance(entry, dict) and "data" in entry and remaining_ms and remaining_ms > 0:
+                    yield entry, remaining_ms / 1000
+
+    def restore_snapshot(self, records):
+        """Store `(entry, remaining_ttl)` records through batched pipelines."""
+        count = 0
+        for batch in _batched(records):
+            pipe = self.redis.pipeline()
+            for entry, remaining in batch:
+                pipe.psetex(entry["user_id"], max(1, int(remaining * 1000)), json.dumps(entry))
+            pipe.execute()
+            count += len(batch)
+        return count
+
     def clear_cache(self, user_id=None):
         """Clear cache for a specific user_id or all if None."""
         if user_id:
@@ -221,10 +385,51 @@ class IPResolverCache:
         """Retrieve cached STUN info if available."""
         return self.cache.get_cached_info(user_id)
 
-    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp):
+    def cache_stun_info(self, user_id, ip, port, nat_type, timestamp, ipv6_ip=None, ipv6_port=None,
+                        ipv4_timestamp=None, ipv6_timestamp=None):
         """Store STUN info in cache."""
-        self.cache.cache_stun_info(user_id, ip, port, nat_type, timestamp)
+        self.cache.cache_stun_info(
+            user_id, ip, port, nat_type, timestamp, ipv6_ip, ipv6_port, ipv4_timestamp, ipv6_timestamp
+        )
 
     def clear_cache(self, user_id=None):
         """Clear cache for a specific user_id or all if None."""
-        self.cache.clear_cache(user_id)
\ No newline at end of file
+        self.cache.clear_cache(user_id)
+
+    def dump_snapshot(self, fp):
+        """Stream live entries to the text file `fp` as newline-delimited JSON.
+
+        The first line is a header; each following line is
+        `[user_id, data, timestamp, remaining_ttl]`. Returns the entry count.
+        """
+        header = {"format": SNAPSHOT_FORMAT, "version": SNAPSHOT_VERSION, "created": time.time()}
+        fp.write(json.dumps(header) + "\n")
+        count = 0
+        for entry, remaining in self.cache.iter_snapshot():
+            record = [entry["user_id"], entry["data"], entry["timestamp"], round(remaining, 3)]
+            fp.write(json.dumps(record, separators=(",", ":")) + "\n")
+            count += 1
+        return count
+
+    def load_snapshot(self, fp):
+        """Stream entries from a snapshot in `fp` into this cache; returns the count loaded.
+
+        Remaining TTLs are reduced by the time elapsed since the dump and capped
+        at this cache's TTL; entries that have expired in between are skipped.
+        """
+        header = json.loads(fp.readline() or "{}")
+        if header.get("format") != SNAPSHOT_FORMAT or header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported cache snapshot format.")
+        elapsed = max(0, time.time() - header["created"])
+        ttl = self.cache.ttl
+
+        def records():
+            for line in fp:
+                if not line.strip():
+                    continue
+                user_id, data, timestamp, remaining = json.loads(line)
+                remaining = min(remaining - elapsed, ttl)
+                if remaining > 0:
+                    yield {"user_id": user_id, "data": data, "timestamp": timestamp}, remaining
+
+        return self.cache.restore_snapshot(records())
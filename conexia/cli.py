@@ -1,21 +1,272 @@
-import asyncio
+import argparse, asyncio, json, sys, time
+from conexia.cache import IPResolverCache
 from conexia.core import STUNClient
+from conexia.exceptions import STUNResolutionError, STUNTimeoutError
+from conexia.metrics import LatencyRecorder
+from conexia.protocol import binding_request
+from conexia.resolver import DNSCache
+from conexia.utils import DEFAULT_STUN_SERVERS, get_user_id
 
+BACKENDS = ["memory", "file", "sqlite", "redis"]
+FORMATS = ["text", "json", "ndjson"]
+TEXT_LABELS = [
+    ("user_id", "User ID"), ("server", "Server"), ("ip", "Public IP"), ("port", "Public Port"),
+    ("nat_type", "NAT Type"), ("ipv6_ip", "Public IPv6"), ("ipv6_port", "Public IPv6 Port"), ("error", "Error"),
+]
 
-async def main():
-    client = STUNClient(cache_backend="file") # Change to "memory", "file", "sqlite", "redis" as needed
-    user_id = await client.get_user_id()
-    public_ip = await client.get_public_ip()
-    public_port = await client.get_public_port()
-    nat_type = await client.get_nat_type()
-    
-    print("User ID:", user_id)
-    print("Public IP:", public_ip)
-    print("Public Port:", public_port)
-    print("NAT Type:", nat_type)
+
+# ================================
+# Helpers
+# ================================
+def parse_server(value, default_port=3478):
+    """Parse `host`, `host:port` or `[ipv6]:port` into `(host, port)`."""
+    if value.startswith("["):
+        host, _, rest = value[1:].partition("]")
+        return host, int(rest.lstrip(":") or default_port)
+    if value.count(":") == 1:
+        host, port = value.split(":")
+        return host, int(port)
+    return value, default_port
+
+
+def server_argument(value):
+    """argparse type for --server: reject malformed `host[:port]` values up front."""
+    try:
+        parse_server(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid server {value!r}, expected host[:port]")
+    return value
+
+
+def configured_servers(args):
+    """Servers given with --server, or every default STUN server."""
+    if args.server:
+        return [parse_server(server) for server in args.server]
+    return [(server["server"], server["port"]) for server in DEFAULT_STUN_SERVERS]
+
+
+def to_record(stun_info, server=None):
+    """Flatten a STUN info dict into one output record."""
+    record = {"user_id": stun_info["user_id"], **stun_info["data"], "timestamp": stun_info["timestamp"]}
+    if server:
+        record["server"] = server
+    return record
+
+
+def emit(record, fmt):
+    """Print one record in the requested output format."""
+    if fmt == "ndjson":
+        print(json.dumps(record, separators=(",", ":")), flush=True)
+    elif fmt == "json":
+        print(json.dumps(record, indent=4), flush=True)
+    else:
+        for key, label in TEXT_LABELS:
+            if record.get(key) is not None:
+                print(f"{label}:", record[key])
+        for key, value in record.items():
+            if isinstance(value, dict):  # Probe statistics
+                print(f"{key}:", ", ".join(f"{k}={v}" for k, v in value.items()))
+            elif key not in dict(TEXT_LABELS) and not key.endswith("timestamp"):
+                print(f"{key}:", value)
+        print(flush=True)
+
+
+def make_client(args, server=None, backend=None):
+    host, port = server or (parse_server(args.server[0]) if args.server else (None, None))
+    return STUNClient(stun_server=host, stun_port=port, cache_backend=backend or args.backend, ttl=args.ttl)
+
+
+# ================================
+# Commands
+# ================================
+async def resolve(args):
+    """Resolve once (a single lookup) and print the result."""
+    client = make_client(args)
+    stun_info = await client.get_stun_info(family=args.family)
+    emit(to_record(stun_info), args.format)
+
+
+async def batch(args):
+    """Resolve against every configured server, bypassing the shared cache.
+
+    Lookups run one after another because pystun3 binds a fixed local port.
+    Differing mapped ports across servers indicate a symmetric NAT.
+    """
+    records = []
+    for host, port in configured_servers(args):
+        client = make_client(args, server=(host, port), backend="memory")
+        try:
+            record = to_record(await client.get_stun_info(family=args.family), server=f"{host}:{port}")
+        except STUNResolutionError as e:
+            record = {"server": f"{host}:{port}", "error": str(e)}
+        if args.format == "json":
+            records.append(record)
+        else:
+            emit(record, args.format)
+    if args.format == "json":
+        print(json.dumps(records, indent=4))
+
+
+async def watch(args):
+    """Re-resolve every `--interval` seconds and print only changed results."""
+    client = make_client(args)
+    user_id = get_user_id(None)
+    previous = None
+    iteration = 0
+    while not args.count or iteration < args.count:
+        if iteration:
+            await asyncio.sleep(args.interval)
+        iteration += 1
+        client.cache.clear_cache(user_id)  # Force a fresh lookup
+        try:
+            stun_info = await client.get_stun_info(family=args.family)
+            # Per-family resolution times change on every lookup; compare mappings only
+            data = {key: value for key, value in stun_info["data"].items() if not key.endswith("_timestamp")}
+            current = {"user_id": stun_info["user_id"], **data}
+        except STUNResolutionError as e:
+            current = {"error": str(e)}
+        if current != previous:
+            emit(dict(current, timestamp=time.time()), args.format)
+            previous = current
+
+
+def probe_families(family):
+    """Families to probe for `--family`; `both` and `any` measure each family separately."""
+    if family == "both":
+        return ("ipv4", "ipv6")
+    if family == "any":
+        return ("ipv6", "ipv4")
+    return (family or "ipv4",)
+
+
+async def probe_server(host, port, family, args, dns):
+    """Time `--attempts` Binding transactions against one server over one address family."""
+    rtt = LatencyRecorder()
+    timeouts = errors = 0
+    started = time.monotonic()
+    try:
+        address = await dns.pick(host, port, family)
+    except OSError as e:
+        return {"server": f"{host}:{port}", "family": family, "error": f"DNS resolution failed: {e}"}
+    dns_ms = (time.monotonic() - started) * 1000
+
+    for _ in range(args.attempts):
+        started = time.monotonic()
+        try:
+            await binding_request(address, port, family=family, timeout=args.timeout, retries=0)
+            rtt.record((time.monotonic() - started) * 1000)
+        except STUNTimeoutError:
+            timeouts += 1
+        except STUNResolutionError:
+            errors += 1
+
+    summary = rtt.summary()
+    return {
+        "server": f"{host}:{port}",
+        "family": family,
+        "address": address,
+        "sent": args.attempts,
+        "received": summary["count"],
+        "loss": round(1 - summary["count"] / args.attempts, 3) if args.attempts else None,
+        "timeouts": timeouts,
+        "errors": errors,
+        "dns_ms": round(dns_ms, 2),
+        "rtt_ms": {key: round(value, 2) for key, value in summary.items() if key != "count" and value is not None},
+    }
+
+
+async def probe(args):
+    """Probe every configured server concurrently and report RTT percentiles and loss."""
+    dns = DNSCache()
+    results = await asyncio.gather(*(
+        probe_server(host, port, family, args, dns)
+        for host, port in configured_servers(args)
+        for family in probe_families(args.family)
+    ))
+    if args.format == "json":
+        print(json.dumps(results, indent=4))
+    else:
+        for record in results:
+            emit(record, args.format)
+
+
+def snapshot(args):
+    """Dump a cache backend to a snapshot file, or load one into it."""
+    cache = IPResolverCache(backend=args.backend, ttl=args.ttl)
+    if args.action == "dump":
+        with open(args.path, "w") as f:
+            count = cache.dump_snapshot(f)
+        print(f"Dumped {count} entries from {args.backend} cache to {args.path}", file=sys.stderr)
+    else:
+        with open(args.path, "r") as f:
+            count = cache.load_snapshot(f)
+        print(f"Loaded {count} entries from {args.path} into {args.backend} cache", file=sys.stderr)
+
+
+# ================================
+# Argument Parsing / Entry Point
+# ================================
+def add_common_arguments(parser, suppress=False):
+    """Options accepted both before and after the subcommand.
+
+    Subcommands use suppressed defaults so they don't override options given
+    before the subcommand name.
+    """
+    def default(value):
+        return argparse.SUPPRESS if suppress else value
+
+    parser.add_argument("--backend", default=default("file"), choices=BACKENDS, help="Cache backend (default: file).")
+    parser.add_argument("--ttl", type=int, default=default(300), help="Cache TTL in seconds (default: 300).")
+    parser.add_argument("--server", action="append", type=server_argument, default=default(None), help="STUN server as host[:port]; repeatable.")
+    parser.add_argument("--family", choices=["ipv4", "ipv6", "both", "any"], default=default(None), help="Address family to resolve.")
+    parser.add_argument("--format", default=default("text"), choices=FORMATS, help="Output format (default: text).")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="conexia", description="Resolve public IP info using STUN servers.")
+    add_common_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command")
+
+    resolve_parser = subparsers.add_parser("resolve", help="Resolve public IP info once (default).")
+    batch_parser = subparsers.add_parser("batch", help="Resolve against each configured server.")
+
+    watch_parser = subparsers.add_parser("watch", help="Re-resolve periodically, print changes.")
+    watch_parser.add_argument("--interval", type=float, default=30, help="Seconds between lookups (default: 30).")
+    watch_parser.add_argument("--count", type=int, default=0, help="Stop after N lookups (default: run forever).")
+
+    probe_parser = subparsers.add_parser("probe", help="Measure RTT and loss per STUN server.")
+    probe_parser.add_argument("--attempts", type=int, default=5, help="Transactions per server (default: 5).")
+    probe_parser.add_argument("--timeout", type=float, default=1, help="Seconds to wait per transaction (default: 1).")
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="Export or import cache entries for warm starts.")
+    snapshot_parser.add_argument("action", choices=["dump", "load"])
+    snapshot_parser.add_argument("path", help="Snapshot file (newline-delimited JSON).")
+
+    for subparser in (resolve_parser, batch_parser, watch_parser, probe_parser, snapshot_parser):
+        add_common_arguments(subparser, suppress=True)
+    return parser.parse_args(argv)
+
+
+COMMANDS = {"resolve": resolve, "batch": batch, "watch": watch, "probe": probe}
+
+
+def main(argv=None):
+    """Console entry point; returns the process exit code."""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    try:
+        if args.command == "snapshot":
+            snapshot(args)
+        else:
+            asyncio.run(COMMANDS[args.command or "resolve"](args))
+    except (STUNResolutionError, OSError, ValueError) as e:  # Includes missing or malformed snapshot files
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
 
 # Execute for CLI only
 if __name__ == "__main__":
-    asyncio.run(main())
+    sys.exit(main())
 
 # Run using: python -m conexia.cli
\ No newline at end of file
@@ -1,18 +1,89 @@
-import asyncio, stun, sqlite3, time, random
+import asyncio, copy, logging, stun, sqlite3, time, random
+from cachetools import TTLCache
 from conexia.cache import *
-from conexia.exceptions import STUNResolutionError
+from conexia.exceptions import STUNResolutionError, STUNBackoffError, STUNTimeoutError
+from conexia.metrics import LatencyRecorder, LossTracker
+from conexia.protocol import binding_request, STUNConnectionPool
+from conexia.resolver import DNSCache
+from conexia.throttle import TokenBucket, CircuitBreaker
 from conexia.utils import get_user_id
 from conexia.utils import DEFAULT_STUN_SERVERS
 
+logger = logging.getLogger(__name__)
+
+# Shared by every client so the process as a whole stays under the outbound budget
+GLOBAL_RATE_LIMITER = TokenBucket(rate=10, capacity=20)
+GLOBAL_DNS_CACHE = DNSCache()
+GLOBAL_CONNECTION_POOL = STUNConnectionPool()
+
+# Cache entry fields holding the mapped address of each family
+FAMILY_KEYS = {"ipv4": ("ip", "port"), "ipv6": ("ipv6_ip", "ipv6_port")}
+FAMILY_TIMESTAMPS = {"ipv4": "ipv4_timestamp", "ipv6": "ipv6_timestamp"}  # When each family was resolved
+HAPPY_EYEBALLS_DELAY = 0.25  # Head start given to IPv6 before IPv4 is attempted (RFC 8305)
+TRANSPORTS = ("udp", "tcp", "tls", "auto")
+STREAM_TRANSPORTS = ("tcp", "tls")
+STUN_TLS_PORT = 5349  # Default port for STUN over TLS (RFC 5389, section 9)
+
 
 class STUNClient:
-    def __init__(self, stun_server=None, stun_port=None, cache_backend="file", ttl=300, **cache_kwargs): #TTL is in seconds
-        """Initialize STUN client with caching support."""
+    def __init__(self, stun_server=None, stun_port=None, cache_backend="file", ttl=300,
+                 negative_ttl=30, fast_fail=False, rate_limiter=None, breaker=None, dual_stack=False,
+                 dns_cache=None, transport="udp", stream_port=None, fallback_transport="tcp",
+                 udp_loss_threshold=0.5, udp_retry_interval=300, connection_pool=None, **cache_kwargs): #TTL is in seconds
+        """Initialize STUN client with caching support.
+
+        Failed lookups are remembered for `negative_ttl` seconds per user/server so
+        an unreachable server does not cost a full STUN timeout on every call.
+        With `fast_fail=True`, lookups that would be skipped or throttled return
+        None immediately instead of raising `STUNBackoffError` or waiting.
+        With `dual_stack=True`, IPv4 and IPv6 mappings are resolved concurrently
+        and stored in the same cache entry. `breaker` is copied per family.
+        The STUN server hostname is resolved through a shared `DNSCache`; when
+        created inside a running event loop the client pre-resolves it right away.
+        `transport` is "udp", "tcp", "tls" (RFC 5389 over pooled, reused
+        connections on `stream_port`) or "auto": UDP, falling back to
+        `fallback_transport` ("tcp" or "tls") when a lookup is lost, and skipping UDP for
+        `udp_retry_interval` seconds once its loss rate reaches `udp_loss_threshold`.
+        `stream_port` defaults to 5349 over TLS and to `stun_port` over TCP.
+        """
+        if transport not in TRANSPORTS:
+            raise ValueError("Invalid transport. Use 'udp', 'tcp', 'tls' or 'auto'.")
+        if fallback_transport not in STREAM_TRANSPORTS:
+            raise ValueError("Invalid fallback transport. Use 'tcp' or 'tls'.")
         server_count = random.randint(0, len(DEFAULT_STUN_SERVERS) - 1)
         self.stun_server = stun_server or DEFAULT_STUN_SERVERS[server_count]["server"]
         self.stun_port = int(stun_port or DEFAULT_STUN_SERVERS[server_count]["port"])
+        self.ttl = ttl
         self.cache = IPResolverCache(backend=cache_backend, ttl=ttl, **cache_kwargs)
-        print(f"Using STUN Server: {self.stun_server}, Port: {self.stun_port}")  # Debugging output
+        self.negative_cache = TTLCache(maxsize=1024, ttl=negative_ttl)  # negative_ttl=0 disables it
+        self.fast_fail = fast_fail
+        self.rate_limiter = rate_limiter or GLOBAL_RATE_LIMITER
+        # Each family trips separately, so a dead IPv6 path never blocks IPv4 lookups
+        self.breakers = {f: copy.copy(breaker) if breaker else CircuitBreaker() for f in FAMILY_KEYS}
+        self.dual_stack = dual_stack
+        self.dns = dns_cache or GLOBAL_DNS_CACHE
+        self.metrics = {"dns": LatencyRecorder(), "lookup": LatencyRecorder()}
+        self.lookup_errors = {"errors": 0, "timeouts": 0}
+        self.transport = transport
+        stream_transport = transport if transport in STREAM_TRANSPORTS else fallback_transport
+        self.stream_port = int(stream_port or (STUN_TLS_PORT if stream_transport == "tls" else self.stun_port))
+        self.fallback_transport = fallback_transport
+        self.udp_loss = LossTracker()
+        self.udp_loss_threshold = udp_loss_threshold
+        self.udp_retry_interval = udp_retry_interval
+        self._udp_degraded_at = None
+        self.pool = connection_pool or GLOBAL_CONNECTION_POOL
+        self._prefetch_task = None
+        logger.debug("Using STUN Server: %s, Port: %s", self.stun_server, self.stun_port)
+
+        try:
+            self._prefetch_task = asyncio.get_running_loop().create_task(self.prefetch())
+        except RuntimeError:
+            pass  # No running loop yet; the first lookup resolves the server instead
+
+    async def prefetch(self):
+        """Resolve the STUN server ahead of the first lookup."""
+        await self.dns.prefetch([(self.stun_server, self.stun_port)], self._requested_families(None))
 
     def _get_cached_ips(self):
         """Retrieve all cached IPs based on backend type."""
@@ -33,13 +104,59 @@ class STUNClient:
 
         return []
 
-    async def get_stun_info(self, request=None):
-        """Retrieve NAT type, external IP, and external port using configurable caching."""
+    def _requested_families(self, family):
+        """Map a `family` argument to the address families to resolve, in preference order."""
+        if family is None:
+            return ("ipv4", "ipv6") if self.dual_stack else ("ipv4",)
+        if family == "both":
+            return ("ipv4", "ipv6")
+        if family == "any":
+            return ("ipv6", "ipv4")
+        if family in FAMILY_KEYS:
+            return (family,)
+        raise ValueError("Invalid address family. Use 'ipv4', 'ipv6', 'both' or 'any'.")
+
+    def _has_family(self, stun_info, family):
+        """Check whether a cache entry holds an unexpired mapping for `family`.
+
+        Each family expires `ttl` after it was resolved, independently of the
+        entry's timestamp, which moves whenever another family is added.
+        """
+        if not stun_info or not stun_info["data"].get(FAMILY_KEYS[family][0]):
+            return False
+        resolved_at = stun_info["data"].get(FAMILY_TIMESTAMPS[family]) or stun_info["timestamp"]
+        return time.time() - resolved_at < self.ttl
+
+    def _is_satisfied(self, stun_info, user_id, family, families):
+        """Check whether a cache entry can answer the request without a lookup.
+
+        Families that failed recently (negatively cached) don't force a new lookup
+        as long as at least one requested family is present.
+        """
+        present = [f for f in families if self._has_family(stun_info, f)]
+        if not present:
+            return False
+        if family == "any":
+            return True
+        return all(f in present or self._negative_key(user_id, f) in self.negative_cache for f in families)
+
+    def _negative_key(self, user_id, family):
+        return (user_id, self.stun_server, self.stun_port, family)
+
+    async def get_stun_info(self, request=None, family=None):
+        """Retrieve NAT type, external IP, and external port using configurable caching.
+
+        `family` selects "ipv4", "ipv6", "both" (resolved concurrently) or "any"
+        (happy-eyeballs race, first family to answer wins). It defaults to "ipv4",
+        or "both" for dual-stack clients.
+        """
 
         timestamp = time.time()  # Current timestamp
+        families = self._requested_families(family)
+        stun_infos = None
 
         try:
-            print("Checking cache for STUN info...")
+            logger.debug("Checking cache for STUN info...")
             
             # Determine user ID (web app users get request.user.id, CLI users get machine UUID)
             user_id = get_user_id(request)
@@ -48,43 +165,220 @@ class STUNClient:
             cached_ip = self._get_cached_ips()
             if cached_ip:
                 stun_infos = self.cache.get_cached_info(user_id)
-                if stun_infos:
-                    print("Found STUN info in cache")
+                if self._is_satisfied(stun_infos, user_id, family, families):
+                    logger.debug("Found STUN info in cache")
                     return stun_infos
-            
+        except Exception as e:
+            raise STUNResolutionError(f"Failed to retrieve STUN Info: {e}")
+
+        # Only look up the families the cached entry is missing
+        if family == "any":
+            outcomes = await self._race_families(user_id, timestamp)
+        else:
+            outcomes = await asyncio.gather(
+                *(self._resolve_family(user_id, f, timestamp) for f in families if not self._has_family(stun_infos, f)),
+                return_exceptions=True,
+            )
+
+        resolved = [outcome for outcome in outcomes if isinstance(outcome, dict)]
+        if not resolved:
+            errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+            if errors and not any(self._has_family(stun_infos, f) for f in families):
+                raise errors[0]
+            return stun_infos  # Serve the families still cached (fast-fail: possibly None)
+
+        # Merge new mappings into the combined entry and save to cache
+        data = {
+            "ip": None, "port": None, "nat_type": None, "ipv6_ip": None, "ipv6_port": None,
+            "ipv4_timestamp": None, "ipv6_timestamp": None,
+        }
+        for f, (ip_key, port_key) in FAMILY_KEYS.items():
+            if self._has_family(stun_infos, f):  # Keep fresh mappings with their original resolution time
+                data[ip_key], data[port_key] = stun_infos["data"][ip_key], stun_infos["data"][port_key]
+                data[FAMILY_TIMESTAMPS[f]] = stun_infos["data"].get(FAMILY_TIMESTAMPS[f]) or stun_infos["timestamp"]
+                if f == "ipv4":
+                    data["nat_type"] = stun_infos["data"].get("nat_type")
+        for result in resolved:
+            ip_key, port_key = FAMILY_KEYS[result["family"]]
+            data[ip_key], data[port_key] = result["ip"], result["port"]
+            data[FAMILY_TIMESTAMPS[result["family"]]] = timestamp
+            if result["family"] == "ipv4":
+                data["nat_type"] = result["nat_type"]
+        self.cache.cache_stun_info(
+            user_id, data["ip"], data["port"], data["nat_type"], timestamp, data["ipv6_ip"], data["ipv6_port"],
+            data["ipv4_timestamp"], data["ipv6_timestamp"],
+        )
+        
+        # Stun info dictionary
+        stun_infos = {
+            "user_id": user_id,
+            "data": data, 
+            "timestamp": timestamp
+        }
+        return stun_infos
+
+    async def _resolve_family(self, user_id, family, timestamp):
+        """Query the STUN server over one address family, honouring backoff state."""
+
+        # Skip servers that failed recently, or back off while the breaker/limiter is engaged
+        negative_key = self._negative_key(user_id, family)
+        breaker = self.breakers[family]
+        if negative_key in self.negative_cache:
+            return self._back_off(f"recent {family} failure for {self.stun_server}:{self.stun_port} is cached")
+        if breaker.is_open():  # Checked before the limiter so an open breaker spends no tokens
+            return self._back_off(f"{family} circuit breaker is open")
+        if self.fast_fail:
+            if not self.rate_limiter.try_acquire():
+                return self._back_off("outbound rate limit reached")
+        else:
+            await self.rate_limiter.acquire()
+        # The half-open trial is only claimed once a token is held, so it always runs
+        trial = breaker.opened_at is not None
+        if not breaker.allow_request():
+            return self._back_off(f"{family} circuit breaker is open")
+
+        started = None
+        try:
             # If not found in cache, query the STUN server
-            print("Fetching new STUN data from server...")
+            logger.debug("Fetching new %s STUN data from server...", family)
+            server_address = await self._resolve_server(family)
+
+            started = time.monotonic()
+            nat_type, ip, port = await self._query(family, server_address)
+        except asyncio.CancelledError:
+            if trial:
+                breaker.release_trial()  # e.g. lost a happy-eyeballs race; let the next caller probe
+            raise
+        except Exception as e:
+            # Failed lookups count towards the durations too, so percentiles include timeouts
+            if started is not None:
+                self.metrics["lookup"].record(time.monotonic() - started)
+            self.lookup_errors["timeouts" if isinstance(e, STUNTimeoutError) else "errors"] += 1
+            self.negative_cache[negative_key] = timestamp
+            breaker.record_failure()
+            raise STUNResolutionError(f"Failed to retrieve STUN Info: {e}")
+
+        self.metrics["lookup"].record(time.monotonic() - started)
+        breaker.record_success()
+        return {"family": family, "ip": ip, "port": port, "nat_type": nat_type}
+
+    def _select_transport(self):
+        """Pick the transport for the next lookup, skipping UDP while it is lossy."""
+        if self.transport != "auto":
+            return self.transport
+        if len(self.udp_loss.outcomes) >= 2 and self.udp_loss.loss_rate() >= self.udp_loss_threshold:
+            if self._udp_degraded_at is None:
+                self._udp_degraded_at = time.monotonic()
+            if time.monotonic() - self._udp_degraded_at < self.udp_retry_interval:
+                return self.fallback_transport
+            # Retry interval elapsed: give UDP a fresh chance
+            self.udp_loss.reset()
+            self._udp_degraded_at = None
+        return "udp"
+
+    async def _query(self, family, server_address):
+        """Run one lookup over the selected transport; returns `(nat_type, ip, port)`."""
+        transport = self._select_transport()
+        if transport == "udp":
+            try:
+                result = await self._query_udp(family, server_address)
+                self.udp_loss.record(False)
+                return result
+            except Exception as e:
+                self.udp_loss.record(True)
+                if self.transport != "auto":
+                    raise
+                logger.debug("UDP lookup failed (%s), falling back to %s", e, self.fallback_transport)
+                transport = self.fallback_transport
+
+        # STUN over TCP/TLS maps a TCP flow, so no UDP NAT type is reported
+        ip, port = await self.pool.binding_request(
+            server_address, self.stream_port, tls=transport == "tls", server_hostname=self.stun_server
+        )
+        return None, ip, port
+
+    async def _query_udp(self, family, server_address):
+        if family == "ipv4":
             loop = asyncio.get_running_loop()
             nat_type, ip, port = await loop.run_in_executor(
-                None, stun.get_ip_info, "0.0.0.0", 54320, self.stun_server, self.stun_port
+                None, stun.get_ip_info, "0.0.0.0", 54320, server_address, self.stun_port
             )
-            # Save to cache
-            self.cache.cache_stun_info(user_id, ip, port, nat_type, timestamp)
-            
-            # Stun info dictionary
-            stun_infos = {
-                "user_id": user_id,
-                "data": {"ip": ip, "port": port, "nat_type": nat_type}, 
-                "timestamp": timestamp
-            }
-            return stun_infos
+        else:
+            # pystun3 is IPv4-only and can't classify IPv6 NATs
+            nat_type = None
+            ip, port = await binding_request(server_address, self.stun_port, family=family)
+        if ip is None:
+            # pystun3 reports timeouts as a "Blocked" NAT type rather than raising
+            raise STUNTimeoutError(f"No response from {self.stun_server}:{self.stun_port} ({nat_type})")
+        return nat_type, ip, port
 
-        except Exception as e:
-            raise STUNResolutionError(f"Failed to retrieve STUN Info: {e}")
+    async def _resolve_server(self, family):
+        """Return a cached address for the STUN server, timing the DNS step separately."""
+        started = time.monotonic()
+        try:
+            return await self.dns.pick(self.stun_server, self.stun_port, family)
+        except Exception:
+            return self.stun_server  # Let the transport resolve it as a last resort
+        finally:
+            self.metrics["dns"].record(time.monotonic() - started)
+
+    def get_latency_metrics(self):
+        """Return DNS resolution and STUN lookup duration summaries (in seconds).
 
+        A lookup is a whole pystun3 run over UDP/IPv4 (several Binding
+        transactions for NAT classification), not a single round trip; use the
+        CLI `probe` command for per-transaction RTTs. Failed lookups are included
+        in the durations and counted under `errors`/`timeouts`.
+        """
+        metrics = {name: recorder.summary() for name, recorder in self.metrics.items()}
+        metrics["lookup"].update(self.lookup_errors)
+        return metrics
+
+    async def _race_families(self, user_id, timestamp):
+        """Happy-eyeballs: start IPv6, give it a head start, then race IPv4 against it."""
+        tasks = []
+        pending = set()
+        for family in self._requested_families("any"):
+            task = asyncio.ensure_future(self._resolve_family(user_id, family, timestamp))
+            tasks.append(task)
+            pending.add(task)
+            deadline = HAPPY_EYEBALLS_DELAY if len(tasks) < 2 else None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break  # Head start elapsed, launch the next family
+                for finished in done:
+                    if not finished.exception() and finished.result():
+                        for loser in pending:
+                            loser.cancel()
+                        return [finished.result()]
+        return [task.exception() or task.result() for task in tasks]
+
+    def _back_off(self, reason):
+        """Return None in fast-fail mode, otherwise raise without touching the network."""
+        if self.fast_fail:
+            return None
+        raise STUNBackoffError(f"Skipped STUN lookup: {reason}")
+
+    def _select(self, stun_info, family, field):
+        """Pick `field` (0 = ip, 1 = port) from the first requested family that is still fresh."""
+        for f in self._requested_families(family):
+            if self._has_family(stun_info, f):
+                return stun_info["data"][FAMILY_KEYS[f][field]]
+        return None
 
     async def get_user_id(self, request=None):
         stun_info = await self.get_stun_info(request)
-        return stun_info["user_id"]
+        return stun_info["user_id"] if stun_info else None
     
-    async def get_public_ip(self, request=None):
-        stun_info = await self.get_stun_info(request)
-        return stun_info["data"]["ip"]
+    async def get_public_ip(self, request=None, family=None):
+        stun_info = await self.get_stun_info(request, family)
+        return self._select(stun_info, family, 0)
 
-    async def get_public_port(self, request=None):
-        stun_info = await self.get_stun_info(request)
-        return stun_info["data"]["port"]
+    async def get_public_port(self, request=None, family=None):
+        stun_info = await self.get_stun_info(request, family)
+        return self._select(stun_info, family, 1)
 
     async def get_nat_type(self, request=None):
         stun_info = await self.get_stun_info(request)
-        return stun_info["data"]["nat_type"]
\ No newline at end of file
+        return stun_info["data"]["nat_type"] if stun_info else None
\ No newline at end of file
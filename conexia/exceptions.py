@@ -1,3 +1,13 @@
 class STUNResolutionError(Exception):
     """Custom exception for STUN resolution errors."""
+    pass
+
+
+class STUNBackoffError(STUNResolutionError):
+    """Raised when a lookup is skipped due to negative caching, rate limiting or an open breaker."""
+    pass
+
+
+class STUNTimeoutError(STUNResolutionError):
+    """Raised when a STUN server does not answer within the retransmission budget."""
     pass
\ No newline at end of file
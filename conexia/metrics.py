@@ -0,0 +1,54 @@
+import math
+from collections import deque
+
+
+# ================================
+# Latency Recorder (Rolling Window)
+# ================================
+class LatencyRecorder:
+    def __init__(self, max_samples=1000):
+        """Keep the most recent `max_samples` latencies (in seconds)."""
+        self.samples = deque(maxlen=max_samples)
+
+    def record(self, seconds):
+        """Add a latency sample."""
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        """Return the `pct` percentile (nearest-rank) of recorded samples, or None."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+        return ordered[rank]
+
+    def summary(self):
+        """Return count, mean and p50/p95/p99 of recorded samples."""
+        count = len(self.samples)
+        return {
+            "count": count,
+            "mean": sum(self.samples) / count if count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+# ================================
+# Loss Tracker (Rolling Window)
+# ================================
+class LossTracker:
+    def __init__(self, window=10):
+        """Track whether the last `window` transactions were answered."""
+        self.outcomes = deque(maxlen=window)
+
+    def record(self, lost):
+        """Record one transaction outcome."""
+        self.outcomes.append(bool(lost))
+
+    def loss_rate(self):
+        """Fraction of recorded transactions that were lost (0 when nothing is recorded)."""
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def reset(self):
+        self.outcomes.clear()
@@ -7,16 +7,17 @@ class STUNMiddleware:
         # Load settings from Django settings.py
         self.cache_backend = getattr(settings, "STUN_CACHE_BACKEND", "file")  # Default: "file"
         self.cache_ttl = getattr(settings, "STUN_CACHE_TTL", 300)  # Default: 300 seconds
+        self.fast_fail = getattr(settings, "STUN_FAST_FAIL", True)  # Don't stall requests on STUN outages
         # Initialize the STUN client with the configured settings
-        self.stun_client = STUNClient(cache_backend=self.cache_backend, ttl=self.cache_ttl)
+        self.stun_client = STUNClient(cache_backend=self.cache_backend, ttl=self.cache_ttl, fast_fail=self.fast_fail)
 
     async def __call__(self, request):
         try:
             # Fetch STUN info asynchronously
-            stun_info = await self.stun_client.get_stun_info(request)
-            ip = stun_info['data']['ip']
-            port = stun_info['data']['port']
-            nat_type = stun_info['data']['nat_type']
+            stun_info = await self.stun_client.get_stun_info(request) or {"data": {}}
+            ip = stun_info['data'].get('ip')
+            port = stun_info['data'].get('port')
+            nat_type = stun_info['data'].get('nat_type')
         except Exception:
             ip, port, nat_type = None, None, None
 
@@ -6,16 +6,16 @@ from conexia.core import STUNClient
 class STUNMiddleware:
     def __init__(self, app):
         self.app = app
-        self.stun_client = STUNClient(cache_backend="file")
+        self.stun_client = STUNClient(cache_backend="file", fast_fail=True)
         app.before_request(self.before_request)
 
     def before_request(self):
         try:
             # Check if the data is cached for request user
-            stun_info = asyncio.run(self.stun_client.get_stun_info(request))
-            ip = stun_info['data']['ip']
-            port = stun_info['data']['port']
-            nat_type = stun_info['data']['nat_type']
+            stun_info = asyncio.run(self.stun_client.get_stun_info(request)) or {"data": {}}
+            ip = stun_info['data'].get('ip')
+            port = stun_info['data'].get('port')
+            nat_type = stun_info['data'].get('nat_type')
         except Exception:
             ip, port, nat_type = None, None, None
 
@@ -0,0 +1,275 @@
+import asyncio, ipaddress, os, socket, struct
+from conexia.exceptions import STUNResolutionError, STUNTimeoutError
+
+
+# Constants (RFC 5389)
+MAGIC_COOKIE = 0x2112A442
+BINDING_REQUEST = 0x0001
+BINDING_SUCCESS = 0x0101
+MAPPED_ADDRESS = 0x0001
+XOR_MAPPED_ADDRESS = 0x0020
+HEADER_SIZE = 20
+
+FAMILIES = {"ipv4": socket.AF_INET, "ipv6": socket.AF_INET6}
+
+
+# ================================
+# Message Encoding / Decoding
+# ================================
+def build_binding_request(transaction_id=None):
+    """Return `(transaction_id, message)` for an attribute-less Binding request."""
+    transaction_id = transaction_id or os.urandom(12)
+    header = struct.pack("!HHI", BINDING_REQUEST, 0, MAGIC_COOKIE)
+    return transaction_id, header + transaction_id
+
+
+def _decode_address(value, transaction_id, xor):
+    """Decode a (XOR-)MAPPED-ADDRESS attribute value into `(ip, port)`."""
+    family, port = struct.unpack("!xBH", value[:4])
+    raw = value[4:]
+    if xor:
+        port ^= MAGIC_COOKIE >> 16
+        mask = struct.pack("!I", MAGIC_COOKIE) + transaction_id
+        raw = bytes(a ^ b for a, b in zip(raw, mask))
+    if family == 0x01:
+        return str(ipaddress.IPv4Address(raw[:4])), port
+    if family == 0x02:
+        return str(ipaddress.IPv6Address(raw[:16])), port
+    raise STUNResolutionError(f"Unknown address family in STUN response: {family}")
+
+
+def parse_binding_response(data, transaction_id):
+    """Extract the mapped `(ip, port)` from a Binding success response.
+
+    Returns None if the message is not a success response to `transaction_id`.
+    XOR-MAPPED-ADDRESS is preferred over the legacy MAPPED-ADDRESS attribute.
+    """
+    if len(data) < HEADER_SIZE:
+        raise STUNResolutionError("Truncated STUN response")
+    msg_type, length = struct.unpack("!HH", data[:4])
+    if msg_type != BINDING_SUCCESS or data[8:HEADER_SIZE] != transaction_id:
+        return None
+
+    mapped = None
+    offset, end = HEADER_SIZE, min(len(data), HEADER_SIZE + length)
+    while offset + 4 <= end:
+        attr_type, attr_len = struct.unpack("!HH", data[offset:offset + 4])
+        value = data[offset + 4:offset + 4 + attr_len]
+        if attr_type == XOR_MAPPED_ADDRESS:
+            return _decode_address(value, transaction_id, xor=True)
+        if attr_type == MAPPED_ADDRESS:
+            mapped = _decode_address(value, transaction_id, xor=False)
+        offset += 4 + attr_len + (-attr_len % 4)  # Attributes are padded to 4 bytes
+    if mapped is None:
+        raise STUNResolutionError("STUN response carries no mapped address")
+    return mapped
+
+
+# ================================
+# Async UDP Binding Transaction
+# ================================
+class _BindingProtocol(asyncio.DatagramProtocol):
+    def __init__(self, transaction_id):
+        self.transaction_id = transaction_id
+        self.result = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        try:
+            mapped = parse_binding_response(data, self.transaction_id)
+        except STUNResolutionError:
+            return  # Ignore malformed datagrams and keep waiting
+        if mapped and not self.result.done():
+            self.result.set_result(mapped)
+
+    def error_received(self, exc):
+        if not self.result.done():
+            self.result.set_exception(exc)
+
+
+async def binding_request(host, port, family="ipv4", timeout=2, retries=3):
+    """Send a Binding request over UDP and return the mapped `(ip, port)`.
+
+    Unlike pystun3, this works for both address families; it does not
+    perform NAT type classification.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(host, port, family=FAMILIES[family], type=socket.SOCK_DGRAM)
+        transaction_id, request = build_binding_request()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _BindingProtocol(transaction_id), remote_addr=infos[0][4][:2], family=FAMILIES[family]
+        )
+    except OSError as e:
+        raise STUNResolutionError(f"Cannot reach {host}:{port} over {family}: {e}")
+
+    try:
+        for _ in range(retries + 1):
+            transport.sendto(request)
+            try:
+                return await asyncio.wait_for(asyncio.shield(protocol.result), timeout)
+            except asyncio.TimeoutError:
+                continue
+            except OSError as e:
+                raise STUNResolutionError(f"Cannot reach {host}:{port} over {family}: {e}")
+        raise STUNTimeoutError(f"No response from {host}:{port} over {family}")
+    finally:
+        transport.close()
+
+
+# ================================
+# STUN over TCP/TLS (Pooled, Pipelined)
+# ================================
+class STUNStreamConnection:
+    def __init__(self, reader, writer):
+        """Carry pipelined Binding transactions over one TCP/TLS connection.
+
+        STUN messages are self-delimiting (length in the header), so responses
+        are read back-to-back and matched to requests by transaction ID.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.pending = {}  # transaction_id -> future
+        self.closed = False
+        self._read_task = self.loop.create_task(self._read_responses())
+
+    async def _read_responses(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(HEADER_SIZE)
+                length = struct.unpack("!H", header[2:4])[0]
+                body = await self.reader.readexactly(length)
+                future = self.pending.pop(header[8:HEADER_SIZE], None)
+                if future and not future.done():
+                    future.set_result(header + body)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            self._fail_pending(STUNResolutionError(f"STUN connection closed: {e}"))
+        finally:
+            self.closed = True
+
+    def _fail_pending(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+    async def request(self, timeout=5):
+        """Send one Binding request and return the mapped `(ip, port)`."""
+        transaction_id, request = build_binding_request()
+        future = self.loop.create_future()
+        self.pending[transaction_id] = future
+        try:
+            self.writer.write(request)
+            await self.writer.drain()
+            response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise STUNTimeoutError("No response over STUN stream connection")
+        except OSError as e:
+            raise STUNResolutionError(f"STUN connection failed: {e}")
+        finally:
+            self.pending.pop(transaction_id, None)
+        mapped = parse_binding_response(response, transaction_id)
+        if mapped is None:  # Matched our transaction ID, so this is a Binding error response
+            msg_type = struct.unpack("!H", response[:2])[0]
+            raise STUNResolutionError(f"STUN server rejected the Binding request (message type 0x{msg_type:04x})")
+        return mapped
+
+    def close(self):
+        """Close the connection from any thread, including after its event loop has closed."""
+        self.closed = True
+        if self.loop.is_closed():
+            # The loop can no longer run transport callbacks: shut the socket down so the
+            # server sees the connection end (the descriptor is freed with the transport)
+            self.pending.clear()
+            sock = self.writer.get_extra_info("socket")
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._close)  # Owned by a loop in another thread
+        else:
+            self._close()
+
+    def _close(self):
+        self._read_task.cancel()
+        self._fail_pending(STUNResolutionError("STUN connection closed"))
+        self.writer.close()
+
+
+class STUNConnectionPool:
+    def __init__(self, ssl_context=None):
+        """Keep one reusable STUN stream connection per (event loop, host, port, tls).
+
+        Connections are bound to the loop that opened them, so each loop (e.g.
+        one per thread) gets its own; they are closed once their loop closes.
+        """
+        self.ssl_context = ssl_context
+        self.connections = {}
+        self._locks = {}
+
+    def _prune(self):
+        """Close and forget connections and locks whose event loop has closed."""
+        for key, connection in list(self.connections.items()):
+            if key[0].is_closed():
+                self.connections.pop(key, None)
+                connection.close()
+        for key in list(self._locks):
+            if key[0].is_closed():
+                self._locks.pop(key, None)
+
+    async def _get_connection(self, host, port, tls, server_hostname):
+        loop = asyncio.get_running_loop()
+        key = (loop, host, port, tls)
+        connection = self.connections.get(key)
+        if connection and not connection.closed:
+            return connection
+
+        self._prune()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:  # Only one caller dials; the others reuse its connection
+            connection = self.connections.get(key)
+            if connection and not connection.closed:
+                return connection
+            if connection:
+                connection.close()  # Dropped by the server
+            ssl_context = None
+            if tls:
+                if self.ssl_context is None:
+                    import ssl
+                    self.ssl_context = ssl.create_default_context()
+                ssl_context = self.ssl_context
+            try:
+                reader, writer = await asyncio.open_connection(
+                    host, port, ssl=ssl_context, server_hostname=(server_hostname or host) if tls else None
+                )
+            except OSError as e:
+                raise STUNResolutionError(f"Cannot connect to {host}:{port} over {'TLS' if tls else 'TCP'}: {e}")
+            connection = self.connections[key] = STUNStreamConnection(reader, writer)
+            return connection
+
+    async def binding_request(self, host, port, tls=False, server_hostname=None, timeout=5):
+        """Run a Binding transaction on the pooled connection, redialing once if it was dropped."""
+        for attempt in range(2):
+            connection = await self._get_connection(host, port, tls, server_hostname)
+            try:
+                return await connection.request(timeout)
+            except STUNTimeoutError:
+                raise
+            except STUNResolutionError:
+                if attempt:
+                    raise
+                connection.close()  # Server closed an idle connection; redial
+
+    def close(self):
+        """Close every pooled connection, whichever event loop owns it."""
+        for connection in list(self.connections.values()):
+            connection.close()
+        self.connections.clear()
+        self._locks.clear()
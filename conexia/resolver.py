@@ -0,0 +1,108 @@
+import asyncio, ipaddress, socket, time
+from conexia.protocol import FAMILIES
+
+try:
+    import dns.asyncresolver, dns.exception  # Optional: dnspython exposes record TTLs
+except ImportError:
+    dns = None
+
+
+# ================================
+# STUN Server DNS Cache
+# ================================
+class DNSCache:
+    def __init__(self, default_ttl=300, min_ttl=30, refresh_ahead=0.8):
+        """Cache resolved STUN server addresses per (host, port, family).
+
+        Record TTLs are honoured when dnspython is installed; otherwise
+        `default_ttl` is used. Entries older than `refresh_ahead` of their TTL
+        are refreshed in the background while the cached addresses keep serving.
+        """
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.refresh_ahead = refresh_ahead
+        self.entries = {}  # key -> {"addresses", "resolved_at", "ttl", "next"}
+        self._refreshing = {}  # key -> in-flight resolution task (bound to the loop that started it)
+
+    async def _lookup(self, host, port, family):
+        """Resolve `host` without blocking the event loop; return `(addresses, ttl)`."""
+        try:
+            ipaddress.ip_address(host)
+            return [host], float("inf")  # IP literals never need resolving
+        except ValueError:
+            pass
+
+        if dns is not None:
+            try:
+                answer = await dns.asyncresolver.resolve(host, "A" if family == "ipv4" else "AAAA")
+            except dns.exception.DNSException as e:
+                # NXDOMAIN, NoAnswer, timeouts...: fail like getaddrinfo so callers catch OSError
+                raise socket.gaierror(f"Cannot resolve {host}: {e}") from e
+            return [record.address for record in answer], max(answer.rrset.ttl, self.min_ttl)
+
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, family=FAMILIES[family], type=socket.SOCK_DGRAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))  # De-duplicate, keep order
+        return addresses, self.default_ttl
+
+    def _inflight(self, key):
+        """Return the running loop's in-flight lookup for `key`, if any.
+
+        The cache may be shared by several event loops (e.g. `asyncio.run` per
+        request on different threads); another loop's task can't be awaited here.
+        """
+        task = self._refreshing.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            return task
+        return None
+
+    async def _refresh(self, key):
+        """Resolve `key` and store the result, sharing one lookup between concurrent callers."""
+        task = self._inflight(key)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup(*key))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda done: self._refreshing.pop(key) if self._refreshing.get(key) is done else None)
+        addresses, ttl = await asyncio.shield(task)
+        previous = self.entries.get(key)
+        self.entries[key] = {
+            "addresses": addresses,
+            "resolved_at": time.monotonic(),
+            "ttl": ttl,
+            "next": previous["next"] if previous else 0,
+        }
+        return self.entries[key]
+
+    async def resolve(self, host, port, family="ipv4"):
+        """Return all cached addresses for `host`, resolving or refreshing as needed."""
+        key = (host, port, family)
+        entry = self.entries.get(key)
+        age = time.monotonic() - entry["resolved_at"] if entry else None
+        if entry is None or age >= entry["ttl"]:
+            entry = await self._refresh(key)
+        elif age >= entry["ttl"] * self.refresh_ahead and self._inflight(key) is None:
+            asyncio.ensure_future(self._refresh(key)).add_done_callback(_consume_exception)
+        return entry["addresses"]
+
+    async def pick(self, host, port, family="ipv4"):
+        """Return one address for `host`, rotating through its records to spread load."""
+        addresses = await self.resolve(host, port, family)
+        if not addresses:
+            raise OSError(f"No {family} address for {host}")
+        entry = self.entries[(host, port, family)]
+        address = addresses[entry["next"] % len(addresses)]
+        entry["next"] += 1
+        return address
+
+    async def prefetch(self, servers, families=("ipv4",)):
+        """Resolve every `(host, port)` in `servers` concurrently; failures are ignored."""
+        await asyncio.gather(
+            *(self.resolve(host, port, family) for host, port in servers for family in families),
+            return_exceptions=True,
+        )
+
+
+def _consume_exception(task):
+    """Background refreshes keep the stale entry on failure; don't log it as unretrieved."""
+    if not task.cancelled():
+        task.exception()
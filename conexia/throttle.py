@@ -0,0 +1,85 @@
+import asyncio, time
+
+
+# ================================
+# Token Bucket (Outbound Rate Limit)
+# ================================
+class TokenBucket:
+    def __init__(self, rate=10.0, capacity=None):
+        """Allow `rate` STUN transactions per second with bursts up to `capacity`."""
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        """Top up tokens according to the time elapsed since the last refill."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        """Take a token if one is available, without waiting."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Wait until a token is available, then take it."""
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ================================
+# Circuit Breaker (Consecutive Failures)
+# ================================
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, recovery_timeout=30):
+        """Open after `failure_threshold` consecutive failures for `recovery_timeout` seconds."""
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def is_open(self):
+        """Return True while requests should be short-circuited, without claiming anything.
+
+        Once `recovery_timeout` has elapsed the breaker is half-open: it reads as
+        closed until a caller claims the single trial with `allow_request()`, then
+        as open until that trial records its outcome. A trial that never reports
+        back is replaced after another `recovery_timeout`.
+        """
+        if self.opened_at is None:
+            return False
+        now = time.monotonic()
+        if now - self.opened_at < self.recovery_timeout:
+            return True
+        return self.probe_started_at is not None and now - self.probe_started_at < self.recovery_timeout
+
+    def allow_request(self):
+        """Return True if a request may go out, claiming the half-open trial if needed."""
+        if self.is_open():
+            return False
+        if self.opened_at is not None:
+            self.probe_started_at = time.monotonic()
+        return True
+
+    def release_trial(self):
+        """Give up a claimed half-open trial without recording an outcome."""
+        self.probe_started_at = None
+
+    def record_success(self):
+        """Reset the failure count and close the breaker."""
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def record_failure(self):
+        """Count a failure and open the breaker once the threshold is reached."""
+        self.failures += 1
+        self.probe_started_at = None
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
@@ -25,7 +25,7 @@ setup(
     include_package_data=True,  # Include non-code files (like README.md)
     entry_points={
         "console_scripts": [
-            "conexio=conexio.cli:main",  # CLI entry point (optional)
+            "conexio=conexia.cli:main",  # CLI entry point (optional)
         ]
     },
 )
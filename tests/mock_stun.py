@@ -0,0 +1,79 @@
+import asyncio
+import ipaddress
+import socket
+import struct
+
+from conexia.protocol import BINDING_SUCCESS, MAGIC_COOKIE, MAPPED_ADDRESS, XOR_MAPPED_ADDRESS
+
+
+def build_binding_response(request, addr):
+    """Build a Binding success response echoing the request's transaction ID.
+
+    Both MAPPED-ADDRESS (read by pystun3) and XOR-MAPPED-ADDRESS are included.
+    """
+    transaction_id = request[8:20]
+    ip = ipaddress.ip_address(addr[0])
+    family = 0x01 if ip.version == 4 else 0x02
+    raw = ip.packed
+    mask = struct.pack("!I", MAGIC_COOKIE) + transaction_id
+    xored = bytes(a ^ b for a, b in zip(raw, mask))
+    attributes = (
+        struct.pack("!HHxBH", MAPPED_ADDRESS, 4 + len(raw), family, addr[1]) + raw
+        + struct.pack("!HHxBH", XOR_MAPPED_ADDRESS, 4 + len(raw), family, addr[1] ^ (MAGIC_COOKIE >> 16)) + xored
+    )
+    return struct.pack("!HH", BINDING_SUCCESS, len(attributes)) + request[4:20] + attributes
+
+
+class MockSTUNProtocol(asyncio.DatagramProtocol):
+    """Answer every Binding request with the sender's address."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.requests += 1
+        self.transport.sendto(build_binding_response(data, addr), addr)
+
+
+async def start_mock_server(host="127.0.0.1"):
+    """Start a UDP mock STUN server on `host`; returns `(transport, protocol, port)`."""
+    loop = asyncio.get_running_loop()
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    transport, protocol = await loop.create_datagram_endpoint(
+        MockSTUNProtocol, local_addr=(host, 0), family=family
+    )
+    return transport, protocol, transport.get_extra_info("sockname")[1]
+
+
+class MockSTUNStreamServer:
+    """TCP mock STUN server; delays some answers so pipelined responses arrive out of order."""
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+
+    async def _answer(self, request, addr, writer, delay):
+        await asyncio.sleep(delay)
+        writer.write(build_binding_response(request, addr))
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        addr = writer.get_extra_info("peername")
+        tasks = []
+        try:
+            while True:
+                request = await reader.readexactly(20)
+                delay = 0.05 if self.requests % 2 == 0 else 0
+                self.requests += 1
+                tasks.append(asyncio.ensure_future(self._answer(request, addr, writer, delay)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def start(self, host="127.0.0.1"):
+        """Start listening; returns `(server, port)`."""
+        server = await asyncio.start_server(self.handle, host, 0)
+        return server, server.sockets[0].getsockname()[1]
@@ -5,9 +5,12 @@ import json  # For handling JSON data storage in file caching
 import unittest  # For running unit tests
 import sqlite3  # For handling SQLite database caching
 import redis  # For handling Redis-based caching
+import io  # For in-memory snapshot files
+from unittest.mock import patch  # For counting batched restore transactions
 
 # Import caching classes from the 'conexia.cache' module
-from conexia.cache import InMemoryCache, FileCache, SQLiteCache, RedisCache
+from conexia.cache import InMemoryCache, FileCache, SQLiteCache, RedisCache, IPResolverCache
+from conexia.cache import SNAPSHOT_BATCH_SIZE, _batched
 
 # Define constants for file-based and SQLite cache paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # Get the directory of the current file
@@ -137,6 +140,73 @@ class TestRedisCache(unittest.TestCase):
         self.cache.clear_cache("user123")
         self.assertIsNone(self.cache.get_cached_info("user123"))
 
+    def test_snapshot_skips_foreign_keys(self):
+        """Test that snapshots skip non-string keys sharing the Redis database."""
+        self.redis_client.rpush("unrelated:list", "value")
+        self.cache.cache_stun_info("user123", "192.168.1.1", 5000, "Full Cone", time.time())
+        try:
+            entries = [entry for entry, _ in self.cache.iter_snapshot()]
+        finally:
+            self.redis_client.delete("unrelated:list")
+        self.assertEqual([entry["user_id"] for entry in entries], ["user123"])
+
+
+# Unit test class for cache snapshots
+class TestCacheSnapshot(unittest.TestCase):
+    def tearDown(self):
+        """Clean up the test files after each test."""
+        for path in (TEST_CACHE_FILE, TEST_DB):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_memory_to_file_round_trip(self):
+        """Test warming a file cache from a memory cache snapshot."""
+        source = IPResolverCache(backend="memory", ttl=300)
+        source.cache_stun_info("user123", "192.168.1.1", 5000, "Full Cone", time.time())
+        snapshot = io.StringIO()
+        self.assertEqual(source.dump_snapshot(snapshot), 1)
+
+        snapshot.seek(0)
+        target = IPResolverCache(backend="file", ttl=300, file_path=TEST_CACHE_FILE)
+        self.assertEqual(target.load_snapshot(snapshot), 1)
+        self.assertEqual(target.get_cached_info("user123")["data"]["ip"], "192.168.1.1")
+        self.assertNotIn("expires_at", target.get_cached_info("user123"))
+
+    def test_remaining_ttl_preserved(self):
+        """Test that restored entries expire with their remaining TTL, not a fresh one."""
+        source = IPResolverCache(backend="sqlite", ttl=300, db_path=TEST_DB)
+        source.cache_stun_info("user123", "192.168.1.1", 5000, "Full Cone", time.time() - 299)
+        snapshot = io.StringIO()
+        source.dump_snapshot(snapshot)
+
+        snapshot.seek(0)
+        target = IPResolverCache(backend="memory", ttl=300)
+        target.load_snapshot(snapshot)
+        self.assertIsNotNone(target.get_cached_info("user123"))
+        time.sleep(1.1)
+        self.assertIsNone(target.get_cached_info("user123"))
+
+    def test_batched_splits_at_batch_size(self):
+        """Test that records are grouped into batches of SNAPSHOT_BATCH_SIZE."""
+        sizes = [len(batch) for batch in _batched(range(2 * SNAPSHOT_BATCH_SIZE + 1))]
+        self.assertEqual(sizes, [SNAPSHOT_BATCH_SIZE, SNAPSHOT_BATCH_SIZE, 1])
+
+    def test_sqlite_restore_is_batched(self):
+        """Test that a SQLite restore commits one transaction per batch."""
+        cache = SQLiteCache(ttl=300, db_path=TEST_DB)
+        records = (
+            ({"user_id": f"user{i}", "data": {"ip": "192.168.1.1", "port": 5000}, "timestamp": time.time()}, 300)
+            for i in range(SNAPSHOT_BATCH_SIZE + 1)
+        )
+        with patch("conexia.cache.sqlite3.connect", wraps=sqlite3.connect) as connect:
+            self.assertEqual(cache.restore_snapshot(records), SNAPSHOT_BATCH_SIZE + 1)
+        self.assertEqual(connect.call_count, 2)
+
+    def test_rejects_unknown_format(self):
+        """Test that non-snapshot input is rejected."""
+        with self.assertRaises(ValueError):
+            IPResolverCache(backend="memory").load_snapshot(io.StringIO("{}\n"))
+
 
 # Run all unit tests when this script is executed directly
 if __name__ == "__main__":
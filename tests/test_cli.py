@@ -1,26 +1,121 @@
-import asyncio
 import io
+import json
+import os
+import tempfile
 import unittest
-from contextlib import redirect_stdout
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
 
 # Import the main() function from your CLI module.
 # Adjust the import path as needed.
-from conexia.cli import main
+from conexia.cli import main, parse_args, parse_server, probe
+from tests.mock_stun import start_mock_server
+
+
+def run_cli(argv):
+    """Run the CLI with `argv` and return what it printed."""
+    captured_output = io.StringIO()
+    # Redirect stdout to capture prints from the main() function.
+    with redirect_stdout(captured_output):
+        exit_code = main(argv)
+    return exit_code, captured_output.getvalue()
+
 
 class TestCLI(unittest.TestCase):
-    def test_cli_output(self):
-        """Test that CLI prints expected output."""
-        captured_output = io.StringIO()
-        # Redirect stdout to capture prints from the main() function.
-        with redirect_stdout(captured_output):
-            asyncio.run(main())
-        output = captured_output.getvalue()
-        
+    @patch("stun.get_ip_info", return_value=("Full Cone", "203.0.113.1", 45678))
+    def test_cli_output(self, mock_stun):
+        """Test that CLI prints expected output from a single lookup."""
+        exit_code, output = run_cli(["--backend", "memory", "--server", "127.0.0.1:3478"])
+
         # Assert that output contains the expected keys.
+        self.assertEqual(exit_code, 0)
         self.assertIn("User ID:", output)
         self.assertIn("Public IP:", output)
         self.assertIn("Public Port:", output)
         self.assertIn("NAT Type:", output)
+        self.assertEqual(mock_stun.call_count, 1)
+
+    @patch("stun.get_ip_info", return_value=("Full Cone", "203.0.113.1", 45678))
+    def test_json_output(self, mock_stun):
+        """Test machine-readable output, with options given after the subcommand."""
+        _, output = run_cli(["resolve", "--backend", "memory", "--server", "127.0.0.1", "--format", "json"])
+        record = json.loads(output)
+        self.assertEqual(record["ip"], "203.0.113.1")
+        self.assertEqual(record["port"], 45678)
+
+    @patch("stun.get_ip_info", side_effect=[("Full Cone", "203.0.113.1", 45678)] * 2 + [("Full Cone", "203.0.113.9", 45678)])
+    def test_watch_emits_changes_only(self, mock_stun):
+        """Test that watch mode prints a line only when the mapping changes."""
+        _, output = run_cli(["--backend", "memory", "--server", "127.0.0.1", "--format", "ndjson",
+                             "watch", "--interval", "0", "--count", "3"])
+        lines = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([line["ip"] for line in lines], ["203.0.113.1", "203.0.113.9"])
+
+    def test_parse_server(self):
+        """Test host, host:port and bracketed IPv6 server arguments."""
+        self.assertEqual(parse_server("stun.example.com"), ("stun.example.com", 3478))
+        self.assertEqual(parse_server("stun.example.com:19302"), ("stun.example.com", 19302))
+        self.assertEqual(parse_server("[::1]:3479"), ("::1", 3479))
+
+    def test_snapshot_errors_exit_cleanly(self):
+        """Test that missing or malformed snapshot files report an error instead of a traceback."""
+        with tempfile.TemporaryDirectory() as tmp:
+            malformed = os.path.join(tmp, "malformed.snapshot")
+            with open(malformed, "w") as f:
+                f.write("{}\n")
+            for path in (os.path.join(tmp, "missing.snapshot"), malformed):
+                errors = io.StringIO()
+                with redirect_stderr(errors):
+                    exit_code, _ = run_cli(["snapshot", "load", path, "--backend", "memory"])
+                self.assertEqual(exit_code, 1)
+                self.assertTrue(errors.getvalue().startswith("Error: "))
+
+    def test_rejects_malformed_server(self):
+        """Test that a non-numeric server port is rejected as a usage error."""
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit) as context:
+            parse_args(["--server", "stun.example.com:notaport"])
+        self.assertEqual(context.exception.code, 2)
+
+
+class TestProbe(unittest.IsolatedAsyncioTestCase):
+    async def test_probe_reports_rtt_and_loss(self):
+        """Test probing a local mock STUN server."""
+        transport, _, port = await start_mock_server("127.0.0.1")
+        args = parse_args(["--format", "json", "probe", "--server", f"127.0.0.1:{port}", "--attempts", "3", "--timeout", "0.2"])
+        output = io.StringIO()
+        try:
+            with redirect_stdout(output):
+                await probe(args)
+        finally:
+            transport.close()
+
+        [result] = json.loads(output.getvalue())
+        self.assertEqual(result["received"], 3)
+        self.assertEqual(result["loss"], 0)
+        self.assertIn("p95", result["rtt_ms"])
+
+    async def test_probe_both_families(self):
+        """Test that `--family both` probes IPv4 and IPv6 separately."""
+        transport4, _, port4 = await start_mock_server("127.0.0.1")
+        transport6, _, port6 = await start_mock_server("::1")
+        args = parse_args([
+            "--format", "json", "probe", "--server", f"127.0.0.1:{port4}", "--server", f"[::1]:{port6}",
+            "--family", "both", "--attempts", "2", "--timeout", "0.2",
+        ])
+        output = io.StringIO()
+        try:
+            with redirect_stdout(output):
+                await probe(args)
+        finally:
+            transport4.close()
+            transport6.close()
+
+        results = {(result["server"], result["family"]): result for result in json.loads(output.getvalue())}
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[(f"127.0.0.1:{port4}", "ipv4")]["received"], 2)
+        self.assertEqual(results[(f"::1:{port6}", "ipv6")]["received"], 2)
+        self.assertFalse(results[(f"127.0.0.1:{port4}", "ipv6")].get("received"))
+
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -1,7 +1,13 @@
+import asyncio
+import socket
+import time
 import unittest
 from unittest.mock import patch, AsyncMock
 from conexia.core import STUNClient
 from conexia.cache import IPResolverCache
+from conexia.exceptions import STUNBackoffError, STUNResolutionError
+from conexia.throttle import TokenBucket, CircuitBreaker
+from tests.mock_stun import start_mock_server, MockSTUNStreamServer
 
 class TestSTUNClient(unittest.IsolatedAsyncioTestCase):
 
@@ -19,6 +25,16 @@ class TestSTUNClient(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result["data"]["port"], 45678)
         self.assertEqual(result["data"]["nat_type"], "Full-Cone NAT")
 
+    @patch("stun.get_ip_info", return_value=("Full-Cone NAT", "203.0.113.1", 45678))
+    async def test_latency_metrics(self, mock_stun):
+        """Test that DNS and STUN latencies are recorded separately."""
+        client = STUNClient(stun_server="127.0.0.1", stun_port=3478, cache_backend="memory")
+        await client.get_stun_info()
+        metrics = client.get_latency_metrics()
+        self.assertEqual(metrics["dns"]["count"], 1)
+        self.assertEqual(metrics["lookup"]["count"], 1)
+        self.assertEqual(mock_stun.call_args[0][2], "127.0.0.1")
+
     async def test_caching(self):
         """Test caching functionality (should return the same cached values)."""
         self.client.cache.cache_stun_info("test_user", "198.51.100.2", 55555, "Symmetric NAT", 1700000000)
@@ -28,6 +44,17 @@ class TestSTUNClient(unittest.IsolatedAsyncioTestCase):
         self.assertIsNotNone(cached_result)
         self.assertEqual(cached_result["data"]["ip"], "198.51.100.2")
 
+    @patch("stun.get_ip_info", return_value=("Blocked", None, None))
+    async def test_latency_metrics_include_timeouts(self, mock_stun):
+        """Test that timed-out lookups are recorded and counted."""
+        client = STUNClient(stun_server="127.0.0.1", stun_port=3478, cache_backend="memory")
+        with self.assertRaises(Exception):
+            await client.get_stun_info()
+        metrics = client.get_latency_metrics()
+        self.assertEqual(metrics["lookup"]["count"], 1)
+        self.assertEqual(metrics["lookup"]["timeouts"], 1)
+        self.assertEqual(metrics["lookup"]["errors"], 0)
+
     @patch("stun.get_ip_info", side_effect=Exception("STUN server unreachable"))
     async def test_stun_resolution_error(self, mock_stun):
         """Test handling of STUN resolution failure."""
@@ -36,5 +63,204 @@ class TestSTUNClient(unittest.IsolatedAsyncioTestCase):
         
         self.assertIn("STUN server unreachable", str(context.exception))
 
+
+class TestSTUNBackoff(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        """Bind a local UDP endpoint that swallows every STUN request."""
+        self.blackhole = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.blackhole.bind(("127.0.0.1", 0))
+        self.port = self.blackhole.getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.blackhole.close()
+
+    async def test_negative_cache_skips_blackholed_server(self):
+        """Test that a timed-out server is not queried again within the negative TTL."""
+        client = STUNClient(stun_server="127.0.0.1", stun_port=self.port, cache_backend="memory")
+        with self.assertRaises(Exception):
+            await client.get_stun_info()
+
+        started = time.monotonic()
+        with self.assertRaises(STUNBackoffError):
+            await client.get_stun_info()
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        client.fast_fail = True
+        self.assertIsNone(await client.get_public_ip())
+
+    @patch("stun.get_ip_info", side_effect=Exception("STUN server unreachable"))
+    async def test_breaker_opens_after_failures(self, mock_stun):
+        """Test that consecutive failures open the breaker and stop outbound queries."""
+        client = STUNClient(cache_backend="memory", negative_ttl=0, breaker=CircuitBreaker(failure_threshold=2))
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                await client.get_stun_info()
+        with self.assertRaises(STUNBackoffError):
+            await client.get_stun_info()
+        self.assertEqual(mock_stun.call_count, 2)
+
+    @patch("stun.get_ip_info", side_effect=Exception("STUN server unreachable"))
+    async def test_half_open_breaker_admits_single_trial(self, mock_stun):
+        """Test that only one concurrent lookup probes a half-open breaker."""
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.1)
+        client = STUNClient(cache_backend="memory", negative_ttl=0, breaker=breaker)
+        with self.assertRaises(Exception):
+            await client.get_stun_info()
+        await asyncio.sleep(0.15)
+
+        mock_stun.side_effect = lambda *args: time.sleep(0.2) or ("Full Cone", "203.0.113.1", 45678)
+        results = await asyncio.gather(*(client.get_stun_info() for _ in range(3)), return_exceptions=True)
+        self.assertEqual(sum(isinstance(result, STUNBackoffError) for result in results), 2)
+        self.assertEqual(mock_stun.call_count, 2)
+        self.assertFalse(client.breakers["ipv4"].is_open())
+
+    @patch("stun.get_ip_info", side_effect=Exception("STUN server unreachable"))
+    async def test_open_breaker_spends_no_tokens(self, mock_stun):
+        """Test that calls rejected by an open breaker leave the rate limiter untouched."""
+        limiter = TokenBucket(rate=0.01, capacity=5)
+        client = STUNClient(cache_backend="memory", negative_ttl=0, rate_limiter=limiter,
+                            breaker=CircuitBreaker(failure_threshold=1))
+        with self.assertRaises(Exception):
+            await client.get_stun_info()
+        for _ in range(3):
+            with self.assertRaises(STUNBackoffError):
+                await client.get_stun_info()
+        self.assertEqual(int(limiter.tokens), 4)
+
+    @patch("stun.get_ip_info", return_value=("Full Cone", "203.0.113.1", 45678))
+    async def test_rate_limiter_fast_fail(self, mock_stun):
+        """Test that fast-fail mode returns None when the token bucket is empty."""
+        client = STUNClient(cache_backend="memory", fast_fail=True, rate_limiter=TokenBucket(rate=0.01, capacity=1))
+        self.assertIsNotNone(await client.get_stun_info())
+        client.cache.clear_cache()
+        self.assertIsNone(await client.get_stun_info())
+        self.assertEqual(mock_stun.call_count, 1)
+
+
+class TestDualStack(unittest.IsolatedAsyncioTestCase):
+
+    async def test_ipv4_loopback_mock(self):
+        """Test IPv4 resolution through pystun3 against a loopback mock server."""
+        transport, _, port = await start_mock_server("127.0.0.1")
+        try:
+            client = STUNClient(stun_server="127.0.0.1", stun_port=port, cache_backend="memory")
+            self.assertEqual(await client.get_public_ip(family="ipv4"), "127.0.0.1")
+        finally:
+            transport.close()
+
+    @patch("stun.get_ip_info", return_value=("Full Cone", "203.0.113.1", 45678))
+    async def test_dual_stack_combined_entry(self, mock_stun):
+        """Test that both families are resolved together and served from one cache entry."""
+        transport, server, port = await start_mock_server("::1")
+        try:
+            client = STUNClient(stun_server="::1", stun_port=port, cache_backend="memory", dual_stack=True)
+            result = await client.get_stun_info()
+            self.assertEqual(result["data"]["ip"], "203.0.113.1")
+            self.assertEqual(result["data"]["ipv6_ip"], "::1")
+
+            self.assertEqual(await client.get_public_ip(family="ipv6"), "::1")
+            self.assertEqual(await client.get_public_ip(family="ipv4"), "203.0.113.1")
+            self.assertEqual(await client.get_public_port(family="ipv4"), 45678)
+            self.assertEqual(server.requests, 1)
+            self.assertEqual(mock_stun.call_count, 1)
+        finally:
+            transport.close()
+
+    @patch("stun.get_ip_info", return_value=("Full Cone", "203.0.113.1", 45678))
+    async def test_families_expire_independently(self, mock_stun):
+        """Test that adding one family does not restart the TTL of the other."""
+        transport, server, port = await start_mock_server("::1")
+        try:
+            client = STUNClient(stun_server="::1", stun_port=port, cache_backend="memory", ttl=1)
+            await client.get_public_ip(family="ipv4")
+            await asyncio.sleep(0.6)
+            await client.get_public_ip(family="ipv6")
+            await asyncio.sleep(0.6)
+
+            entry = await client.get_stun_info(family="both")
+            self.assertEqual(mock_stun.call_count, 2)  # IPv4 expired and was resolved again
+            self.assertEqual(server.requests, 1)  # IPv6 is still fresh
+            self.assertEqual(entry["data"]["ipv6_ip"], "::1")
+        finally:
+            transport.close()
+
+    @patch("stun.get_ip_info", return_value=("Full Cone", "203.0.113.1", 45678))
+    async def test_unreachable_ipv6_keeps_ipv4(self, mock_stun):
+        """Test that a dual-stack client on an IPv4-only network keeps serving IPv4."""
+        refused = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        refused.bind(("::1", 0))
+        port = refused.getsockname()[1]
+        refused.close()  # Nothing listens here any more: IPv6 lookups are refused
+
+        client = STUNClient(stun_server="::1", stun_port=port, cache_backend="memory", dual_stack=True,
+                            negative_ttl=0, breaker=CircuitBreaker(failure_threshold=2))
+        for _ in range(4):
+            result = await client.get_stun_info()
+            self.assertEqual(result["data"]["ip"], "203.0.113.1")
+            self.assertIsNone(result["data"]["ipv6_ip"])
+        self.assertTrue(client.breakers["ipv6"].is_open())
+
+        client.cache.clear_cache()
+        self.assertEqual(await client.get_public_ip(family="ipv4"), "203.0.113.1")
+        with self.assertRaises(STUNResolutionError):
+            await client.get_public_ip(family="ipv6")
+
+    @patch("stun.get_ip_info", side_effect=lambda *args: time.sleep(1) or ("Full Cone", "203.0.113.1", 45678))
+    async def test_happy_eyeballs_prefers_fast_family(self, mock_stun):
+        """Test that racing families returns the first answer without waiting for the other."""
+        transport, _, port = await start_mock_server("::1")
+        try:
+            client = STUNClient(stun_server="::1", stun_port=port, cache_backend="memory")
+            started = time.monotonic()
+            self.assertEqual(await client.get_public_ip(family="any"), "::1")
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            transport.close()
+
+
+class TestStreamFallback(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.mock = MockSTUNStreamServer()
+        self.server, self.port = await self.mock.start()
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_tcp_transport(self):
+        """Test resolving over STUN-over-TCP against a local mock server."""
+        client = STUNClient(stun_server="127.0.0.1", stun_port=self.port, cache_backend="memory", transport="tcp")
+        self.assertEqual(await client.get_public_ip(), "127.0.0.1")
+
+    @patch("stun.get_ip_info", return_value=("Blocked", None, None))
+    async def test_auto_falls_back_on_udp_loss(self, mock_stun):
+        """Test that lost UDP lookups fall back to TCP and lossy UDP is then skipped."""
+        client = STUNClient(stun_server="127.0.0.1", stun_port=3478, stream_port=self.port,
+                            cache_backend="memory", transport="auto")
+        for _ in range(4):
+            self.assertEqual(await client.get_public_ip(), "127.0.0.1")
+            client.cache.clear_cache()
+        self.assertEqual(mock_stun.call_count, 2)
+        self.assertEqual(self.mock.requests, 4)
+        self.assertEqual(self.mock.connections, 1)
+
+    def test_stream_port_defaults(self):
+        """Test that TLS defaults to port 5349 while TCP keeps the STUN port."""
+        def stream_port(**kwargs):
+            return STUNClient(stun_server="127.0.0.1", stun_port=3478, cache_backend="memory", **kwargs).stream_port
+        self.assertEqual(stream_port(transport="tcp"), 3478)
+        self.assertEqual(stream_port(transport="tls"), 5349)
+        self.assertEqual(stream_port(transport="auto", fallback_transport="tls"), 5349)
+        self.assertEqual(stream_port(transport="tls", stream_port=443), 443)
+
+    def test_rejects_invalid_fallback_transport(self):
+        """Test that the fallback must be a stream transport."""
+        for fallback in ("udp", "auto", "quic"):
+            with self.assertRaises(ValueError):
+                STUNClient(stun_server="127.0.0.1", cache_backend="memory", transport="auto", fallback_transport=fallback)
+
+
 if __name__ == "__main__":
     unittest.main()
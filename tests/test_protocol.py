@@ -0,0 +1,184 @@
+import asyncio
+import socket
+import struct
+import threading
+import unittest
+from conexia.exceptions import STUNResolutionError, STUNTimeoutError
+from conexia.protocol import binding_request, build_binding_request, parse_binding_response, STUNConnectionPool
+from tests.mock_stun import build_binding_response, start_mock_server, MockSTUNStreamServer
+
+
+class TestBindingMessages(unittest.TestCase):
+
+    def test_parse_ipv4_response(self):
+        """Test decoding an IPv4 mapped address from a Binding response."""
+        transaction_id, request = build_binding_request()
+        response = build_binding_response(request, ("203.0.113.1", 45678))
+        self.assertEqual(parse_binding_response(response, transaction_id), ("203.0.113.1", 45678))
+
+    def test_parse_ipv6_response(self):
+        """Test decoding an IPv6 XOR-mapped address from a Binding response."""
+        transaction_id, request = build_binding_request()
+        response = build_binding_response(request, ("2001:db8::1", 45678))
+        self.assertEqual(parse_binding_response(response, transaction_id), ("2001:db8::1", 45678))
+
+    def test_ignores_foreign_transaction(self):
+        """Test that responses to other transactions are ignored."""
+        _, request = build_binding_request()
+        response = build_binding_response(request, ("203.0.113.1", 45678))
+        self.assertIsNone(parse_binding_response(response, b"\x00" * 12))
+
+    def test_truncated_response(self):
+        """Test that truncated messages raise STUNResolutionError."""
+        with self.assertRaises(STUNResolutionError):
+            parse_binding_response(b"\x01\x01", b"\x00" * 12)
+
+
+class TestBindingRequest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_ipv4_loopback(self):
+        """Test a Binding transaction against an IPv4 loopback mock server."""
+        transport, _, port = await start_mock_server("127.0.0.1")
+        try:
+            ip, _ = await binding_request("127.0.0.1", port, family="ipv4")
+        finally:
+            transport.close()
+        self.assertEqual(ip, "127.0.0.1")
+
+    async def test_ipv6_loopback(self):
+        """Test a Binding transaction against an IPv6 loopback mock server."""
+        transport, _, port = await start_mock_server("::1")
+        try:
+            ip, _ = await binding_request("::1", port, family="ipv6")
+        finally:
+            transport.close()
+        self.assertEqual(ip, "::1")
+
+
+class TestStreamTransport(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.mock = MockSTUNStreamServer()
+        self.server, self.port = await self.mock.start()
+        self.pool = STUNConnectionPool()
+
+    async def asyncTearDown(self):
+        self.pool.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_pipelines_on_one_connection(self):
+        """Test that concurrent transactions share one pooled TCP connection."""
+        results = await asyncio.gather(*(self.pool.binding_request("127.0.0.1", self.port) for _ in range(5)))
+        self.assertEqual({ip for ip, _ in results}, {"127.0.0.1"})
+        self.assertEqual(self.mock.connections, 1)
+        self.assertEqual(self.mock.requests, 5)
+
+    async def test_reuses_connection(self):
+        """Test that sequential transactions reuse the pooled connection."""
+        for _ in range(3):
+            await self.pool.binding_request("127.0.0.1", self.port)
+        self.assertEqual(self.mock.connections, 1)
+
+    async def test_redials_dropped_connection(self):
+        """Test that a dropped connection is replaced transparently."""
+        await self.pool.binding_request("127.0.0.1", self.port)
+        for connection in self.pool.connections.values():
+            connection.writer.close()
+        await asyncio.sleep(0.01)
+        ip, _ = await self.pool.binding_request("127.0.0.1", self.port)
+        self.assertEqual(ip, "127.0.0.1")
+        self.assertEqual(self.mock.connections, 2)
+
+    async def test_error_response_raises(self):
+        """Test that a Binding error response raises instead of returning None."""
+        async def reject(reader, writer):
+            try:
+                while True:
+                    request = await reader.readexactly(20)
+                    writer.write(struct.pack("!HH", 0x0111, 0) + request[4:20])
+            except asyncio.IncompleteReadError:
+                writer.close()
+
+        server = await asyncio.start_server(reject, "127.0.0.1", 0)
+        try:
+            with self.assertRaises(STUNResolutionError):
+                await self.pool.binding_request("127.0.0.1", server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            await server.wait_closed()
+
+
+class TestPoolAcrossLoops(unittest.TestCase):
+
+    def test_releases_connection_from_closed_loop(self):
+        """Test that a connection left over from a closed event loop is shut down, not leaked."""
+        listener = socket.create_server(("127.0.0.1", 0))
+        listener.settimeout(2)
+        port = listener.getsockname()[1]
+        pool = STUNConnectionPool()
+
+        async def unanswered_request():
+            with self.assertRaises(STUNTimeoutError):
+                await pool.binding_request("127.0.0.1", port, timeout=0.05)
+
+        asyncio.run(unanswered_request())
+        first, _ = listener.accept()
+        asyncio.run(unanswered_request())  # New loop: the first connection must be closed and replaced
+        second, _ = listener.accept()
+        pool.close()
+        try:
+            for peer in (first, second):
+                peer.settimeout(2)
+                while peer.recv(1024):
+                    pass  # Drain the Binding request until the client closes its end
+        finally:
+            for sock in (first, second, listener):
+                sock.close()
+
+    def test_threads_keep_their_own_connections(self):
+        """Test that event loops on different threads don't evict each other's connections."""
+        server_loop = asyncio.new_event_loop()
+        server_thread = threading.Thread(target=server_loop.run_forever)
+        server_thread.start()
+        mock = MockSTUNStreamServer()
+        server, port = asyncio.run_coroutine_threadsafe(mock.start(), server_loop).result()
+        pool = STUNConnectionPool()
+        results, failures = [], []
+
+        async def requests():
+            for _ in range(25):
+                results.append(await pool.binding_request("127.0.0.1", port))
+
+        def worker():
+            try:
+                asyncio.run(requests())
+            except Exception as e:
+                failures.append(e)
+
+        workers = [threading.Thread(target=worker) for _ in range(2)]
+        try:
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        finally:
+            pool.close()
+
+            async def stop_server():
+                await asyncio.sleep(0.05)  # Let the handlers see the clients hang up
+                server.close()
+                await server.wait_closed()
+
+            asyncio.run_coroutine_threadsafe(stop_server(), server_loop).result()
+            server_loop.call_soon_threadsafe(server_loop.stop)
+            server_thread.join()
+            server_loop.close()
+
+        self.assertEqual(failures, [])
+        self.assertEqual(len(results), 50)
+        self.assertEqual(mock.connections, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
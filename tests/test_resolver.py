@@ -0,0 +1,84 @@
+import asyncio
+import socket
+import threading
+import types
+import unittest
+from unittest.mock import AsyncMock, patch
+from conexia.metrics import LatencyRecorder
+from conexia.resolver import DNSCache
+
+
+class TestDNSCache(unittest.IsolatedAsyncioTestCase):
+
+    async def test_caches_lookups(self):
+        """Test that repeated resolutions are served from cache."""
+        cache = DNSCache()
+        with patch.object(cache, "_lookup", new_callable=AsyncMock, return_value=(["192.0.2.1"], 300)) as lookup:
+            await cache.resolve("stun.example.com", 3478)
+            await cache.resolve("stun.example.com", 3478)
+        self.assertEqual(lookup.call_count, 1)
+
+    async def test_pick_rotates_records(self):
+        """Test that picks spread load across all A records."""
+        cache = DNSCache()
+        with patch.object(cache, "_lookup", new_callable=AsyncMock, return_value=(["192.0.2.1", "192.0.2.2"], 300)):
+            picks = [await cache.pick("stun.example.com", 3478) for _ in range(4)]
+        self.assertEqual(picks, ["192.0.2.1", "192.0.2.2", "192.0.2.1", "192.0.2.2"])
+
+    async def test_refreshes_in_background(self):
+        """Test that entries close to expiry are served stale while refreshing."""
+        cache = DNSCache(refresh_ahead=0)
+        with patch.object(cache, "_lookup", new_callable=AsyncMock, side_effect=[(["192.0.2.1"], 300), (["192.0.2.9"], 300)]):
+            await cache.resolve("stun.example.com", 3478)
+            self.assertEqual(await cache.resolve("stun.example.com", 3478), ["192.0.2.1"])
+            await asyncio.sleep(0.01)  # Let the background refresh finish
+            self.assertEqual(await cache.resolve("stun.example.com", 3478), ["192.0.2.9"])
+
+    async def test_dnspython_errors_raise_oserror(self):
+        """Test that dnspython failures surface as OSError like getaddrinfo failures."""
+        class DNSException(Exception):
+            pass
+
+        fake_dns = types.SimpleNamespace(
+            asyncresolver=types.SimpleNamespace(resolve=AsyncMock(side_effect=DNSException("NXDOMAIN"))),
+            exception=types.SimpleNamespace(DNSException=DNSException),
+        )
+        with patch("conexia.resolver.dns", fake_dns):
+            with self.assertRaises(socket.gaierror):
+                await DNSCache().pick("missing.example.com", 3478)
+
+    async def test_lookups_not_shared_across_loops(self):
+        """Test that a lookup in flight on another thread's loop is not awaited here."""
+        cache = DNSCache()
+
+        async def slow_lookup(host, port, family):
+            await asyncio.sleep(0.2)
+            return ["192.0.2.1"], 300
+
+        with patch.object(cache, "_lookup", slow_lookup):
+            other = threading.Thread(target=asyncio.run, args=(cache.resolve("stun.example.com", 3478),))
+            other.start()
+            await asyncio.sleep(0.05)  # The other loop's lookup is now in flight
+            self.assertEqual(await cache.resolve("stun.example.com", 3478), ["192.0.2.1"])
+            other.join()
+
+    async def test_ip_literal(self):
+        """Test that IP literals are returned without a lookup."""
+        self.assertEqual(await DNSCache().resolve("::1", 3478, family="ipv6"), ["::1"])
+
+
+class TestLatencyRecorder(unittest.TestCase):
+
+    def test_summary(self):
+        """Test nearest-rank percentiles over recorded samples."""
+        recorder = LatencyRecorder()
+        for sample in range(1, 101):
+            recorder.record(sample / 1000)
+        summary = recorder.summary()
+        self.assertEqual(summary["count"], 100)
+        self.assertEqual(summary["p50"], 0.05)
+        self.assertEqual(summary["p99"], 0.099)
+
+
+if __name__ == "__main__":
+    unittest.main()